@@ -1,35 +1,42 @@
+import os
 from dataclasses import dataclass
-from environs import Env
-from typing import List
+from functools import lru_cache
+from typing import List, Optional
 
-@dataclass
+from dotenv import load_dotenv
+
+@dataclass(slots=True, frozen=True)
 class TgBot:
     token: str
     channel_id: str
     admin_id: int
     update_interval: int
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class CurrencyConfig:
     currencies: List[str]
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Config:
     tg_bot: TgBot
     currency: CurrencyConfig
 
-def load_config(path: str = None) -> Config:
-    env = Env()
-    env.read_env(path)
+@lru_cache(maxsize=1)
+def load_config(path: Optional[str] = None) -> Config:
+    load_dotenv(path)
 
     return Config(
         tg_bot=TgBot(
-            token=env.str("TELEGRAM_BOT_TOKEN"),
-            channel_id=env.str("CHANNEL_ID"),
-            admin_id=env.int("ADMIN_ID"),
-            update_interval=env.int("UPDATE_INTERVAL", 3600)
+            token=os.environ["TELEGRAM_BOT_TOKEN"],
+            channel_id=os.environ["CHANNEL_ID"],
+            admin_id=int(os.environ["ADMIN_ID"]),
+            update_interval=int(os.environ.get("UPDATE_INTERVAL", 3600))
         ),
         currency=CurrencyConfig(
-            currencies=env.list("CURRENCIES", ["USD", "EUR", "CAD"])
+            currencies=[
+                currency.strip()
+                for currency in os.environ.get("CURRENCIES", "USD,EUR,CAD").split(",")
+                if currency.strip()
+            ]
         )
     )
\ No newline at end of file
@@ -1,8 +1,10 @@
 import asyncio
 import logging
 from datetime import datetime, timedelta
-from typing import List, Dict
-import pytz
+from itertools import groupby
+from operator import attrgetter
+from typing import List
+from zoneinfo import ZoneInfo
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
 from aiogram.enums import ParseMode
@@ -11,9 +13,10 @@ from apscheduler.triggers.cron import CronTrigger
 
 from config import Config, load_config
 from utils import (
+    Event,
     scrape_forex_factory, 
-    filter_events, 
     escape_markdown, 
+    forex_factory,
     NewsTracker
 )
 
@@ -27,90 +30,101 @@ logger = logging.getLogger(__name__)
 # Load config
 config = load_config()
 
+# Currencies to track, checked on every calendar event
+CURRENCIES = frozenset(config.currency.currencies)
+
 # Initialize bot and dispatcher
 bot = Bot(token=config.tg_bot.token)
 dp = Dispatcher()
 
+# How late (in seconds) a notification may still be sent, e.g. after a restart
+NOTIFICATION_GRACE_TIME = 60
+
+# Minutes before an event to notify at, 0 is the event start
+NOTIFICATION_THRESHOLDS = (60, 30, 15, 5, 1, 0)
+
 # Initialize news tracker
 news_tracker = NewsTracker()
 
 # Define GMT+5 timezone
-TIMEZONE = pytz.timezone('Asia/Tashkent')
+TIMEZONE = ZoneInfo('Asia/Tashkent')
 
-def get_upcoming_events(hours: int = 24) -> List[Dict]:
+# Longest window (in hours) /upcoming can show
+MAX_UPCOMING_HOURS = 72
+
+# Static message templates, already escaped for MARKDOWN_V2
+_WELCOME = (
+    "👋 *Welcome to Forex News Bot\\!*\n\n"
+    "I will help you track important forex news events\\.\n\n"
+    "*Available Commands:*\n"
+    "🔹 /help \\- Show all commands\n\n"
+    "All times are shown in GMT\\+5 timezone\\.\n\n"
+    "I will automatically post updates to the channel\\."
+)
+_WELCOME_FALLBACK = "Welcome to Forex News Bot! Use /help to see available commands."
+_HELP = (
+    "📱 *Forex News Bot Commands*\n\n"
+    "👑 *Admin Commands:*\n"
+    "🔸 /upcoming \\- Show upcoming events \\(1\\-72 hours\\)\n\n"
+    "Bot automatically sends:\n"
+    "📅 Weekly schedule every Monday at 7 AM\n"
+    "⏰ Notifications at 60, 30, 15, 5, and 1 minute before events\n"
+    "🚨 Event start notifications\n\n"
+    "All times are shown in GMT\\+5 timezone\\."
+)
+_HELP_FALLBACK = (
+    "Forex News Bot Commands\n\n"
+    "Admin Commands:\n"
+    "/upcoming - Show upcoming events (1-72 hours)\n\n"
+    "Bot automatically sends:\n"
+    "- Weekly schedule every Monday at 7 AM\n"
+    "- Notifications before events\n"
+    "- Event start notifications\n\n"
+    "All times are shown in GMT+5 timezone."
+)
+_WEEKLY_HEADER = "📅 *Weekly Economic Calendar*\n\n"
+_UPCOMING_HEADERS = {
+    hours: f"📊 *Upcoming Events \\(Next {hours} hours\\)*\n\n"
+    for hours in range(1, MAX_UPCOMING_HOURS + 1)
+}
+_NO_PERMISSION = "You don't have permission to use this command\\."
+_NO_EVENTS = "No upcoming events found\\."
+_INVALID_HOURS = (
+    "Please use a valid number of hours \\(1\\-72\\)\\.\n"
+    "Example: /upcoming 12"
+)
+_UPCOMING_ERROR = "Error fetching upcoming events\\. Please try again later\\."
+
+async def get_upcoming_events(hours: int = 24) -> List[Event]:
     """Get news events for the next specified hours"""
     try:
-        events = scrape_forex_factory()
-        filtered_events = filter_events(events, config.currency.currencies)
-        
         now = datetime.now(TIMEZONE)
-        
-        upcoming_events = []
-        for event in filtered_events:
-            try:
-                event_date = datetime.strptime(f"{event['date']} {event['time']}", '%b %d %I:%M%p')
-                event_date = event_date.replace(year=now.year)
-                event_date = TIMEZONE.localize(event_date)
-                
-                if event_date.date() == now.date() and event_date.time() < now.time():
-                    event_date = event_date.replace(year=now.year + 1)
-                
-                time_diff = event_date - now
-                if timedelta(0) <= time_diff <= timedelta(hours=hours):
-                    event['datetime'] = event_date
-                    upcoming_events.append(event)
-            except ValueError as e:
-                logger.error(f"Error parsing date/time for event: {event}")
-                continue
-        
-        upcoming_events.sort(key=lambda x: x['datetime'])
-        return upcoming_events
+        return await forex_factory.get_events_between(now, now + timedelta(hours=hours), CURRENCIES)
     except Exception as e:
         logger.error(f"Error getting upcoming events: {e}")
         return []
 
-def format_event_message(event: Dict) -> str:
-    """Format a single event message"""
-    impact_emoji = {
-        "Low": "🟢",
-        "Medium": "🟡",
-        "High": "🔴",
-        "Holiday": "🏁"
-    }.get(event['impact'], "⚪")
-    
-    event_time = escape_markdown(event['time'])
-    currency = escape_markdown(event['currency'])
-    impact = escape_markdown(str(event['impact']))
-    event_name = escape_markdown(event['event'])
-    
-    return (
-        f"*Time:* {event_time}\n"
-        f"*Currency:* {currency}\n"
-        f"*Impact:* {impact_emoji} {impact}\n"
-        f"*Event:* {event_name}\n"
-    )
-
 async def send_weekly_schedule():
     """Send full week's schedule every Monday at 7 AM GMT+5"""
     logger.info("Sending weekly schedule")
     try:
-        events = scrape_forex_factory()
-        filtered_events = filter_events(events, config.currency.currencies)
+        filtered_events = await scrape_forex_factory(CURRENCIES)
         
         if filtered_events:
-            message = "📅 *Weekly Economic Calendar*\n\n"
+            chunks: List[str] = [_WEEKLY_HEADER]
             current_date = None
             
             for event in filtered_events:
-                if event.get('date') != current_date:
-                    current_date = event['date']
-                    message += f"\n📌 *{escape_markdown(current_date)}*\n\n"
+                if event.date != current_date:
+                    current_date = event.date
+                    chunks.append(f"\n📌 *{escape_markdown(current_date)}*\n\n")
                 
-                message += format_event_message(event) + "\n"
+                chunks.append(event.msg)
+                chunks.append("\n")
             
             await bot.send_message(
                 chat_id=config.tg_bot.channel_id,
-                text=message,
+                text="".join(chunks),
                 parse_mode=ParseMode.MARKDOWN_V2
             )
             
@@ -118,64 +132,88 @@ async def send_weekly_schedule():
     except Exception as e:
         logger.error(f"Error sending weekly schedule: {e}")
 
-async def check_upcoming_news():
-    """Check for upcoming news events and send notifications"""
+def notification_id(event: Event, threshold: int) -> str:
+    """Build the sent news ID for an event notification"""
+    return f"{event.id}_t{threshold}" if threshold else f"{event.id}_started"
+
+async def send_notification(events: List[Event], threshold: int):
+    """Send one notification `threshold` minutes before events released together (0 means now)"""
+    due = [event for event in events if not news_tracker.is_news_sent(notification_id(event, threshold))]
+    if not due:
+        return
+    
     try:
-        upcoming_events = get_upcoming_events(2)  # Get events for next 2 hours
+        title = "Events" if len(due) > 1 else "Event"
+        if threshold:
+            header = f"⚠️ *{title} in {threshold} minute{'s' if threshold > 1 else ''}*\n\n"
+        else:
+            header = f"🚨 *{title} Starting Now*\n\n"
+        
+        await bot.send_message(
+            chat_id=config.tg_bot.channel_id,
+            text=header + "\n".join(event.msg for event in due),
+            parse_mode=ParseMode.MARKDOWN_V2
+        )
+        
+        for event in due:
+            news_tracker.mark_as_sent(notification_id(event, threshold))
+        news_tracker.flush()
+    except Exception as e:
+        logger.error(f"Error sending event notification: {e}")
+
+async def schedule_notifications(scheduler: AsyncIOScheduler):
+    """Schedule one-shot notification jobs for events starting soon"""
+    try:
+        if not await scrape_forex_factory(CURRENCIES):
+            # Keep already scheduled notifications if the calendar couldn't be fetched
+            return
+        
+        # Only events whose notifications can fall before the next couple of refreshes
+        # need jobs now, later ones get scheduled by a following run
         now = datetime.now(TIMEZONE)
+        start = now - timedelta(seconds=NOTIFICATION_GRACE_TIME)
+        end = now + timedelta(minutes=max(NOTIFICATION_THRESHOLDS), seconds=2 * forex_factory.ttl)
+        events = await forex_factory.get_events_between(start, end, CURRENCIES)
         
-        for event in upcoming_events:
-            try:
-                time_diff = (event['datetime'] - now).total_seconds() / 60
-                
-                # Define notification thresholds
-                thresholds = [60, 30, 15, 5, 1]
+        scheduled = set()
+        # Events are sorted by time, so events released together share a single message
+        for event_time, group in groupby(events, key=attrgetter('datetime')):
+            group = list(group)
+            for threshold in NOTIFICATION_THRESHOLDS:
+                run_date = event_time - timedelta(minutes=threshold)
+                if (now - run_date).total_seconds() > NOTIFICATION_GRACE_TIME:
+                    continue
                 
-                for threshold in thresholds:
-                    notification_id = f"{event['id']}_t{threshold}"
-                    
-                    if threshold - 1 <= time_diff <= threshold and not news_tracker.is_news_sent(notification_id):
-                        message = (
-                            f"⚠️ *Event in {threshold} minute{'s' if threshold > 1 else ''}*\n\n"
-                            f"{format_event_message(event)}"
-                        )
-                        
-                        await bot.send_message(
-                            chat_id=config.tg_bot.channel_id,
-                            text=message,
-                            parse_mode=ParseMode.MARKDOWN_V2
-                        )
-                        
-                        news_tracker.mark_as_sent(notification_id)
-                
-                # Send "News started" message
-                if 0 <= time_diff < 1 and not news_tracker.is_news_sent(f"{event['id']}_started"):
-                    message = (
-                        "🚨 *Event Starting Now*\n\n"
-                        f"{format_event_message(event)}"
-                    )
-                    
-                    await bot.send_message(
-                        chat_id=config.tg_bot.channel_id,
-                        text=message,
-                        parse_mode=ParseMode.MARKDOWN_V2
-                    )
-                    
-                    news_tracker.mark_as_sent(f"{event['id']}_started")
-                    
-            except Exception as e:
-                logger.error(f"Error processing event notification: {e}")
-                continue
+                if all(news_tracker.is_news_sent(notification_id(event, threshold)) for event in group):
+                    continue
                 
+                job_id = f"{event_time.isoformat()}_t{threshold}"
+                scheduler.add_job(
+                    send_notification,
+                    'date',
+                    run_date=run_date,
+                    args=[group, threshold],
+                    id=job_id,
+                    replace_existing=True,
+                    misfire_grace_time=NOTIFICATION_GRACE_TIME
+                )
+                scheduled.add(job_id)
+        
+        # Drop notifications for events that were removed from the calendar
+        for job in scheduler.get_jobs():
+            if job.func is send_notification and job.id not in scheduled:
+                job.remove()
+        
+        logger.info(f"Scheduled {len(scheduled)} event notifications")
     except Exception as e:
-        logger.error(f"Error checking upcoming news: {e}")
+        logger.error(f"Error scheduling event notifications: {e}")
 
 @dp.message(Command(commands=["upcoming"]))
 async def cmd_upcoming(message: types.Message):
     """Show upcoming events (admin only)"""
     if message.from_user.id != config.tg_bot.admin_id:
         await message.answer(
-            "You don't have permission to use this command\\.",
+            _NO_PERMISSION,
             parse_mode=ParseMode.MARKDOWN_V2
         )
         return
@@ -183,94 +221,62 @@ async def cmd_upcoming(message: types.Message):
     try:
         parts = message.text.split()
         hours = int(parts[1]) if len(parts) > 1 else 24
-        hours = min(max(hours, 1), 72)
+        hours = min(max(hours, 1), MAX_UPCOMING_HOURS)
         
-        upcoming_events = get_upcoming_events(hours)
+        upcoming_events = await get_upcoming_events(hours)
         
         if upcoming_events:
-            message_text = f"📊 *Upcoming Events \\(Next {hours} hours\\)*\n\n"
+            chunks: List[str] = [_UPCOMING_HEADERS[hours]]
             
             for event in upcoming_events:
-                message_text += format_event_message(event) + "\n"
+                chunks.append(event.msg)
+                chunks.append("\n")
                 
             await message.answer(
-                text=message_text,
+                text="".join(chunks),
                 parse_mode=ParseMode.MARKDOWN_V2
             )
         else:
             await message.answer(
-                "No upcoming events found\\.",
+                _NO_EVENTS,
                 parse_mode=ParseMode.MARKDOWN_V2
             )
             
     except ValueError:
         await message.answer(
-            "Please use a valid number of hours \\(1\\-72\\)\\.\n"
-            "Example: /upcoming 12",
+            _INVALID_HOURS,
             parse_mode=ParseMode.MARKDOWN_V2
         )
     except Exception as e:
         logger.error(f"Error in cmd_upcoming: {e}")
         await message.answer(
-            "Error fetching upcoming events\\. Please try again later\\.",
+            _UPCOMING_ERROR,
             parse_mode=ParseMode.MARKDOWN_V2
         )
 
 @dp.message(Command(commands=["start"]))
 async def cmd_start(message: types.Message):
     """Handle the start command"""
-    welcome_text = (
-        "👋 *Welcome to Forex News Bot\\!*\n\n"
-        "I will help you track important forex news events\\.\n\n"
-        "*Available Commands:*\n"
-        "🔹 /help \\- Show all commands\n\n"
-        "All times are shown in GMT\\+5 timezone\\.\n\n"
-        "I will automatically post updates to the channel\\."
-    )
-    
     try:
         await message.answer(
-            text=welcome_text,
+            text=_WELCOME,
             parse_mode=ParseMode.MARKDOWN_V2
         )
     except Exception as e:
         logger.error(f"Error sending start message: {e}")
-        await message.answer(
-            "Welcome to Forex News Bot! Use /help to see available commands."
-        )
+        await message.answer(_WELCOME_FALLBACK)
 
 @dp.message(Command(commands=["help"]))
 async def cmd_help(message: types.Message):
     """Show help message"""
-    help_text = (
-        "📱 *Forex News Bot Commands*\n\n"
-        "👑 *Admin Commands:*\n"
-        "🔸 /upcoming \\- Show upcoming events \\(1\\-72 hours\\)\n\n"
-        "Bot automatically sends:\n"
-        "📅 Weekly schedule every Monday at 7 AM\n"
-        "⏰ Notifications at 60, 30, 15, 5, and 1 minute before events\n"
-        "🚨 Event start notifications\n\n"
-        "All times are shown in GMT\\+5 timezone\\."
-    )
-    
     try:
         await message.answer(
-            text=help_text,
+            text=_HELP,
             parse_mode=ParseMode.MARKDOWN_V2
         )
     except Exception as e:
         logger.error(f"Error sending help message: {e}")
-        fallback_text = (
-            "Forex News Bot Commands\n\n"
-            "Admin Commands:\n"
-            "/upcoming - Show upcoming events (1-72 hours)\n\n"
-            "Bot automatically sends:\n"
-            "- Weekly schedule every Monday at 7 AM\n"
-            "- Notifications before events\n"
-            "- Event start notifications\n\n"
-            "All times are shown in GMT+5 timezone."
-        )
-        await message.answer(text=fallback_text)
+        await message.answer(text=_HELP_FALLBACK)
 
 async def main():
     """Main function to start the bot"""
@@ -284,11 +290,13 @@ async def main():
         CronTrigger(day_of_week='mon', hour=7, minute=0, timezone=TIMEZONE)
     )
     
-    # Schedule checks for upcoming events every 5 minutes
+    # Reschedule event notifications whenever the calendar cache can be refreshed
     scheduler.add_job(
-        check_upcoming_news,
+        schedule_notifications,
         'interval',
-        minutes=5
+        seconds=forex_factory.ttl,
+        args=[scheduler],
+        next_run_time=datetime.now(TIMEZONE)
     )
     
     try:
@@ -301,6 +309,7 @@ async def main():
             
         await dp.start_polling(bot)
     finally:
+        await forex_factory.close()
         await bot.session.close()
 
 if __name__ == "__main__":
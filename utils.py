@@ -1,77 +1,217 @@
-import json
+import asyncio
+import hashlib
 import os
-import requests
 import time
 import logging
-from typing import List, Dict, Optional, Set
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import List, Dict, FrozenSet, Optional, Tuple
 from datetime import datetime, timedelta
-import pytz
+from zoneinfo import ZoneInfo
+import aiohttp
+import orjson
+
+# aiohttp only decodes brotli responses when the brotli package is installed
+try:
+    import brotli  # noqa: F401
+    ACCEPT_ENCODING = 'gzip, deflate, br'
+except ImportError:
+    ACCEPT_ENCODING = 'gzip, deflate'
+
+# Use the C ISO 8601 parser when available, datetime.fromisoformat handles 'Z' since Python 3.11
+try:
+    from ciso8601 import parse_datetime
+except ImportError:
+    parse_datetime = datetime.fromisoformat
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+DEFAULT_CURRENCIES = frozenset(['USD', 'EUR', 'CAD'])
+IMPACT_MAP = {'Holiday': 0, 'Low': 1, 'Medium': 2, 'High': 3}
+
+@dataclass(slots=True)
+class Event:
+    """Calendar event, built once per calendar refresh and shared by reference"""
+    date: str
+    time: str
+    datetime: datetime
+    currency: str
+    impact: int
+    event: str
+    forecast: str
+    previous: str
+    id: str = ""
+    msg: str = ""
+
 class ForexFactoryCalendar:
-    def __init__(self):
+    def __init__(self, ttl: int = 600):
         self.api_url = "https://nfs.faireconomy.media/ff_calendar_thisweek.json"
-        self.session = requests.Session()
-        self.timezone = pytz.timezone('Asia/Tashkent')  # GMT+5
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.timezone = ZoneInfo('Asia/Tashkent')  # GMT+5
+        self.ttl = ttl
+        self._cache: Optional[Tuple[float, List[Event]]] = None
+        self._currencies: FrozenSet[str] = DEFAULT_CURRENCIES
+        self._dt_list: List[datetime] = []
+        self._etag: Optional[str] = None
+        self._last_modified: Optional[str] = None
 
     def _get_headers(self):
         return {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
             'Accept': 'application/json',
+            'Accept-Encoding': ACCEPT_ENCODING,
             'Accept-Language': 'en-US,en;q=0.9'
         }
 
-    def get_calendar(self) -> List[Dict]:
-        """Get calendar data from Forex Factory API"""
+    def _get_conditional_headers(self):
+        headers = self._get_headers()
+        if self._cache is not None:
+            if self._etag:
+                headers['If-None-Match'] = self._etag
+            if self._last_modified:
+                headers['If-Modified-Since'] = self._last_modified
+        return headers
+
+    def invalidate(self):
+        """Drop cached calendar so the next call refetches it"""
+        self._cache = None
+        self._dt_list = []
+        self._etag = None
+        self._last_modified = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=15))
+        return self._session
+
+    async def close(self):
+        """Close the HTTP session"""
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+            self._refresh_task = None
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    def _is_fresh(self) -> bool:
+        return self._cache is not None and time.monotonic() - self._cache[0] < self.ttl
+
+    async def get_calendar(self, allowed_currencies: FrozenSet[str] = DEFAULT_CURRENCIES) -> List[Event]:
+        """Get calendar data from Forex Factory API (cached for `ttl` seconds)"""
+        # Cached events were filtered for another set of currencies
+        if allowed_currencies != self._currencies:
+            self.invalidate()
+            self._currencies = allowed_currencies
+
+        if self._is_fresh():
+            return self._cache[1]
+
+        async with self._lock:
+            # Another caller may have refreshed the calendar while we waited
+            if self._is_fresh():
+                return self._cache[1]
+            return await self._fetch_calendar(allowed_currencies)
+
+    async def _fetch_calendar(self, allowed_currencies: FrozenSet[str]) -> List[Event]:
         try:
-            response = self.session.get(
+            async with self._get_session().get(
                 self.api_url,
-                headers=self._get_headers(),
-                timeout=15
-            )
-            response.raise_for_status()
-            
-            events = response.json()
-            return self._process_events(events)
+                headers=self._get_conditional_headers()
+            ) as response:
+                # Calendar unchanged since last fetch, keep the parsed events
+                if response.status == 304 and self._cache is not None:
+                    self._cache = (time.monotonic(), self._cache[1])
+                    return self._cache[1]
+
+                response.raise_for_status()
+                
+                events = orjson.loads(await response.read())
+                processed = self._process_events(events, allowed_currencies)
+
+                self._cache = (time.monotonic(), processed)
+                self._dt_list = [event.datetime for event in processed]
+                self._etag = response.headers.get('ETag')
+                self._last_modified = response.headers.get('Last-Modified')
+                return processed
             
         except Exception as e:
             logger.error(f"Error getting Forex Factory calendar: {e}")
+            if self._cache is not None:
+                return self._cache[1]
             return []
 
-    def _process_events(self, events: List[Dict]) -> List[Dict]:
+    async def get_snapshot(self, allowed_currencies: FrozenSet[str] = DEFAULT_CURRENCIES) -> List[Event]:
+        """Get the cached, time-sorted calendar without waiting on the network
+
+        A stale snapshot is returned as is and refreshed in the background, only
+        a cold cache is fetched inline.
+        """
+        if self._cache is None or allowed_currencies != self._currencies:
+            return await self.get_calendar(allowed_currencies)
+
+        if not self._is_fresh() and (self._refresh_task is None or self._refresh_task.done()):
+            self._refresh_task = asyncio.create_task(self.get_calendar(allowed_currencies))
+        return self._cache[1]
+
+    async def get_events_between(
+        self,
+        start: datetime,
+        end: datetime,
+        allowed_currencies: FrozenSet[str] = DEFAULT_CURRENCIES
+    ) -> List[Event]:
+        """Get snapshot events with start <= datetime <= end, in chronological order"""
+        events = await self.get_snapshot(allowed_currencies)
+        lo = bisect_left(self._dt_list, start)
+        hi = bisect_right(self._dt_list, end)
+        return events[lo:hi]
+
+    def _process_events(self, events: List[Dict], allowed_currencies: FrozenSet[str]) -> List[Event]:
         """Process and format events from Forex Factory"""
-        formatted_events = []
+        formatted_events: List[Event] = []
         
         try:
             for event in events:
                 try:
+                    if event['country'] not in allowed_currencies:
+                        continue
+                    
                     # Parse datetime
-                    event_date = datetime.fromisoformat(event['date'].replace('Z', '+00:00'))
+                    event_date = parse_datetime(event['date'])
                     event_date = event_date.astimezone(self.timezone)
                     
-                    # Map impact levels
-                    impact_map = {
-                        'Low': 1,
-                        'Medium': 2,
-                        'High': 3,
-                        'Holiday': 0
-                    }
+                    event_data = Event(
+                        date=event_date.strftime('%b %d'),
+                        time=event_date.strftime('%I:%M%p'),
+                        datetime=event_date,
+                        currency=event['country'],
+                        impact=IMPACT_MAP.get(event['impact'], 1),
+                        event=event['title'],
+                        forecast=event.get('forecast', 'N/A'),
+                        previous=event.get('previous', 'N/A')
+                    )
                     
-                    event_data = {
-                        'date': event_date.strftime('%b %d'),
-                        'time': event_date.strftime('%I:%M%p'),
-                        'currency': event['country'],
-                        'impact': impact_map.get(event['impact'], 1),
-                        'event': event['title'],
-                        'forecast': event.get('forecast', 'N/A'),
-                        'previous': event.get('previous', 'N/A')
-                    }
+                    # Generate unique ID, hashed to keep sent news keys short
+                    event_data.id = hashlib.blake2b(
+                        f"{event_data.date}|{event_data.time}|{event_data.currency}|{event_data.event}".encode(),
+                        digest_size=8
+                    ).hexdigest()
                     
-                    # Generate unique ID
-                    event_data['id'] = f"{event_data['date']}_{event_data['time']}_{event_data['currency']}_{event_data['event']}"
+                    # Add values only if they're available and not 'N/A'
+                    values = []
+                    if event_data.forecast != 'N/A' and event_data.forecast:
+                        values.append(f"F: {event_data.forecast}")
+                    if event_data.previous != 'N/A' and event_data.previous:
+                        values.append(f"P: {event_data.previous}")
+                    
+                    if values:
+                        event_data.event = f"{event_data.event} ({', '.join(values)})"
+                    
+                    # Event content doesn't change until the next refresh, render it once
+                    event_data.msg = format_event_message(event_data)
                     formatted_events.append(event_data)
                     
                 except Exception as e:
@@ -80,81 +220,120 @@ class ForexFactoryCalendar:
                     
         except Exception as e:
             logger.error(f"Error processing events: {e}")
-            
+        
+        # Keep events ordered by time so windows can be sliced with bisect
+        formatted_events.sort(key=lambda x: x.datetime)
         return formatted_events
 
 class NewsTracker:
-    def __init__(self, filename: str = "sent_news.json"):
+    def __init__(self, filename: str = "sent_news.json", max_age: int = 2 * 3600):
         self.filename = filename
-        self.sent_news: Set[str] = self._load_sent_news()
+        # Sent news can't match again once every notification of the event is past,
+        # so entries are dropped `max_age` seconds after they were sent
+        self.max_age = max_age
+        self.sent_news: Dict[str, float] = self._load_sent_news()
+        self._dirty = False
 
-    def _load_sent_news(self) -> Set[str]:
+    def _load_sent_news(self) -> Dict[str, float]:
         if os.path.exists(self.filename):
-            with open(self.filename, 'r') as f:
-                return set(json.load(f))
-        return set()
+            with open(self.filename, 'rb') as f:
+                data = orjson.loads(f.read())
+            
+            # Older versions stored a plain list of IDs
+            if isinstance(data, list):
+                now = time.time()
+                data = {news_id: now for news_id in data}
+            
+            # Keep entries ordered by sent time so pruning can stop at the first fresh one
+            sent_news = dict(sorted(data.items(), key=lambda item: item[1]))
+            self._prune(sent_news)
+            return sent_news
+        return {}
 
     def _save_sent_news(self):
-        with open(self.filename, 'w') as f:
-            json.dump(list(self.sent_news), f)
+        with open(self.filename, 'wb') as f:
+            f.write(orjson.dumps(self.sent_news))
+
+    def _prune(self, sent_news: Dict[str, float]):
+        """Drop entries older than `max_age`, oldest first"""
+        cutoff = time.time() - self.max_age
+        while sent_news:
+            news_id = next(iter(sent_news))
+            if sent_news[news_id] >= cutoff:
+                break
+            del sent_news[news_id]
+            self._dirty = True
 
     def is_news_sent(self, news_id: str) -> bool:
         return news_id in self.sent_news
 
     def mark_as_sent(self, news_id: str):
-        self.sent_news.add(news_id)
-        self._save_sent_news()
+        """Mark news as sent, call flush() to persist it"""
+        # Re-insert so the dict stays ordered by sent time
+        self.sent_news.pop(news_id, None)
+        self.sent_news[news_id] = time.time()
+        self._prune(self.sent_news)
+        self._dirty = True
+
+    def flush(self):
+        """Write sent news to disk if anything changed since the last flush"""
+        if self._dirty:
+            self._save_sent_news()
+            self._dirty = False
+
+# Translation table escaping special characters for MARKDOWN_V2
+_MD_TABLE = str.maketrans({char: f'\\{char}' for char in '_*[]()~`>#+-=|{}.!'})
 
 def escape_markdown(text: str) -> str:
     """Escape special characters for MARKDOWN_V2"""
-    if not text:
-        return ""
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    for char in special_chars:
-        text = str(text).replace(char, f'\\{char}')
-    return text
+    return text.translate(_MD_TABLE) if text else ""
+
+# Impact level -> (emoji, label), labels need no MARKDOWN_V2 escaping
+_IMPACT_EMOJI = {
+    0: ("🏁", "Holiday"),
+    1: ("🟢", "Low"),
+    2: ("🟡", "Medium"),
+    3: ("🔴", "High")
+}
+
+def format_event_message(event: Event) -> str:
+    """Format a single event message"""
+    impact_emoji, impact = _IMPACT_EMOJI.get(event.impact, ("⚪", "Unknown"))
+    
+    event_time = escape_markdown(event.time)
+    currency = escape_markdown(event.currency)
+    event_name = escape_markdown(event.event)
+    
+    return (
+        f"*Time:* {event_time}\n"
+        f"*Currency:* {currency}\n"
+        f"*Impact:* {impact_emoji} {impact}\n"
+        f"*Event:* {event_name}\n"
+    )
 
 # Initialize calendar handler
 forex_factory = ForexFactoryCalendar()
 
-def get_forex_events() -> List[Dict]:
-    """Get forex calendar data"""
+async def get_forex_events(currencies: FrozenSet[str] = DEFAULT_CURRENCIES) -> List[Event]:
+    """Get forex calendar data for the given currencies"""
     try:
-        events = forex_factory.get_calendar()
+        events = await forex_factory.get_calendar(currencies)
         logger.info(f"Retrieved {len(events)} events from Forex Factory")
         return events
     except Exception as e:
         logger.error(f"Error getting calendar data: {e}")
         return []
 
-def filter_events(events: List[Dict], currencies: Optional[List[str]] = None) -> List[Dict]:
-    """Filter events by currency and convert impact to text"""
-    if currencies is None:
-        currencies = ['USD', 'EUR', 'CAD']
-    
-    filtered_events = []
-    impact_map = {0: "Holiday", 1: "Low", 2: "Medium", 3: "High"}
-    
-    for event in events:
-        if event['currency'] in currencies:
-            event_copy = event.copy()
-            event_copy['impact'] = impact_map.get(event_copy['impact'], "Unknown")
-            
-            # Add values only if they're available and not 'N/A'
-            values = []
-            if event_copy['forecast'] != 'N/A' and event_copy['forecast']:
-                values.append(f"F: {event_copy['forecast']}")
-            if event_copy['previous'] != 'N/A' and event_copy['previous']:
-                values.append(f"P: {event_copy['previous']}")
-            
-            if values:
-                event_copy['event'] = f"{event_copy['event']} ({', '.join(values)})"
-            
-            filtered_events.append(event_copy)
-    
-    return filtered_events
+def filter_events(events: List[Event], currencies: Optional[List[str]] = None) -> List[Event]:
+    """Filter events by currency
+
+    Events from the calendar are already filtered and formatted, this is kept
+    for compatibility with existing code.
+    """
+    allowed = DEFAULT_CURRENCIES if currencies is None else frozenset(currencies)
+    return [event for event in events if event.currency in allowed]
 
 # For compatibility with existing code
-def scrape_forex_factory() -> List[Dict]:
+async def scrape_forex_factory(currencies: FrozenSet[str] = DEFAULT_CURRENCIES) -> List[Event]:
     """Compatibility function for existing code"""
-    return get_forex_events()
\ No newline at end of file
+    return await get_forex_events(currencies)
\ No newline at end of file